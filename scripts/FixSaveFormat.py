@@ -14,15 +14,13 @@ import os
 # Change this to your folder path
 folder_path = "path/to/your/folder"
 
-for filename in os.listdir(folder_path):
-    if filename.endswith(".png") and ".mp4" in filename:
-        # Split at ".mp4" and take the first part
-        new_name = filename.split(".mp4")[0] + ".png"
-        
-        # Get full paths
-        old_path = os.path.join(folder_path, filename)
-        new_path = os.path.join(folder_path, new_name)
-        
-        # Rename the file
-        os.rename(old_path, new_path)
-        print(f"Renamed: {filename} -> {new_name}")
+with os.scandir(folder_path) as entries:
+    for entry in entries:
+        filename = entry.name
+        if filename.endswith(".png") and ".mp4" in filename:
+            # Keep everything before the first ".mp4"
+            new_name = filename.partition(".mp4")[0] + ".png"
+
+            # Rename the file
+            os.rename(entry.path, os.path.join(folder_path, new_name))
+            print(f"Renamed: {filename} -> {new_name}")
@@ -3,14 +3,19 @@
 Script to save the images in the right size for the Roku app
 """
 # pip install pillow
+# (on x86, "pip install pillow-simd" is a drop-in replacement with a faster resize)
 import os
+from concurrent.futures import ProcessPoolExecutor
 from PIL import Image, ImageOps
 
 INPUT_DIR = "/path/to/Videos/images"     # change this
 OUTPUT_DIR = os.path.join(INPUT_DIR, "resized")  # subdirectory for results
 TARGET_W, TARGET_H = 440, 350
+IMAGE_EXTS = (".png", ".jpg", ".jpeg", ".webp", ".bmp", ".tiff")
 
-os.makedirs(OUTPUT_DIR, exist_ok=True)
+# BICUBIC is roughly twice as fast as LANCZOS and looks the same at card size;
+# switch to Image.Resampling.LANCZOS if you prefer
+RESAMPLE = Image.Resampling.BICUBIC
 
 def resize_cover_center_crop(img: Image.Image, tw: int, th: int) -> Image.Image:
     # Respect EXIF orientation
@@ -20,7 +25,7 @@ def resize_cover_center_crop(img: Image.Image, tw: int, th: int) -> Image.Image:
     # Scale to cover the target (no letterboxing), maintain aspect ratio
     scale = max(tw / w, th / h)
     new_w, new_h = int(round(w * scale)), int(round(h * scale))
-    img = img.resize((new_w, new_h), Image.Resampling.LANCZOS)
+    img = img.resize((new_w, new_h), RESAMPLE)
 
     # Center crop to exact target size
     left   = (new_w - tw) // 2
@@ -29,19 +34,22 @@ def resize_cover_center_crop(img: Image.Image, tw: int, th: int) -> Image.Image:
     bottom = top + th
     return img.crop((left, top, right, bottom))
 
-# Process images
-for name in os.listdir(INPUT_DIR):
-    src = os.path.join(INPUT_DIR, name)
-    if not os.path.isfile(src):
-        continue
-
-    # Only handle common image types
-    lower = name.lower()
-    if not lower.endswith((".png", ".jpg", ".jpeg", ".webp", ".bmp", ".tiff")):
-        continue
+def jpeg_draft(img: Image.Image, tw: int, th: int) -> None:
+    # Let libjpeg decode at 1/2, 1/4 or 1/8 scale while keeping at least
+    # twice the cover size. EXIF rotation happens after decoding, so allow
+    # for either orientation.
+    w, h = img.size
+    scale = max(tw / w, th / h, tw / h, th / w) * 2
+    if scale < 1:
+        img.draft("RGB", (int(w * scale), int(h * scale)))
 
+def process_one(name: str) -> str:
+    """Resize a single image from INPUT_DIR; returns a line to print."""
+    src = os.path.join(INPUT_DIR, name)
     try:
         with Image.open(src) as im:
+            if im.format == "JPEG":
+                jpeg_draft(im, TARGET_W, TARGET_H)
             out_im = resize_cover_center_crop(im, TARGET_W, TARGET_H)
 
             # Save as PNG (or keep original extension if you prefer)
@@ -51,7 +59,20 @@ for name in os.listdir(INPUT_DIR):
             if out_im.mode not in ("RGB", "RGBA"):
                 out_im = out_im.convert("RGBA" if "A" in out_im.getbands() else "RGB")
             out_im.save(dst, format="PNG", optimize=True)
-            print(f"Saved: {dst}")
+            return f"Saved: {dst}"
     except Exception as e:
-        print(f"Skipping {name}: {e}")
+        return f"Skipping {name}: {e}"
+
+if __name__ == "__main__":
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+
+    # Only handle common image types
+    names = [
+        name for name in os.listdir(INPUT_DIR)
+        if name.lower().endswith(IMAGE_EXTS) and os.path.isfile(os.path.join(INPUT_DIR, name))
+    ]
 
+    # Images are independent, so spread them over every core
+    with ProcessPoolExecutor(max_workers=os.cpu_count()) as executor:
+        for msg in executor.map(process_one, names, chunksize=8):
+            print(msg)
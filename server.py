@@ -1,22 +1,30 @@
 #!/usr/bin/env python3
 import os
+import queue
+import re
 import sqlite3
 import threading
 import time
 import hmac
 import base64
+import functools
 import hashlib
-import mimetypes
+from contextlib import contextmanager
+from email.utils import formatdate, parsedate_to_datetime
 from pathlib import Path
-from typing import Dict, List, Optional, Tuple
+from typing import Dict, List, Optional, Set, Tuple
+from urllib.parse import quote
 
+import anyio
 import uvicorn
 from fastapi import FastAPI, HTTPException, Header, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse, StreamingResponse, JSONResponse, RedirectResponse
+from fastapi.responses import FileResponse, StreamingResponse, JSONResponse, ORJSONResponse, RedirectResponse, Response
 from pydantic import BaseModel
 import yaml
 from fastapi.staticfiles import StaticFiles
+from starlette.datastructures import Headers
+from starlette.types import Receive, Scope, Send
 
 # ------------------------------------------------------------
 # Configuration
@@ -31,6 +39,24 @@ SUB_EXTS = [".srt", ".vtt"]
 ART_EXTS = [".png", ".jpg", ".jpeg", ".webp"]
 DEFAULT_HIDDEN_DIRS = ["images"]
 
+# Content types for every extension we serve, so requests skip mimetypes
+MIME_TYPES = {
+    ".mp4": "video/mp4",
+    ".m4v": "video/mp4",
+    ".mkv": "video/x-matroska",
+    ".mov": "video/quicktime",
+    ".avi": "video/x-msvideo",
+    ".wmv": "video/x-ms-wmv",
+    ".mpg": "video/mpeg",
+    ".mpeg": "video/mpeg",
+    ".srt": "text/plain",
+    ".vtt": "text/vtt",
+    ".png": "image/png",
+    ".jpg": "image/jpeg",
+    ".jpeg": "image/jpeg",
+    ".webp": "image/webp",
+}
+
 class Settings(BaseModel):
     # Required
     library_root: str
@@ -46,6 +72,9 @@ class Settings(BaseModel):
     kids_paths: List[str] = []           # (kept for backwards-compat)
     adult_paths: List[str] = []          # NEW: explicit adult-only paths
     hidden_dir_names: List[str] = DEFAULT_HIDDEN_DIRS
+    # Behind nginx: hand /api/stream bytes off via X-Accel-Redirect
+    use_x_accel_redirect: bool = False
+    x_accel_prefix: str = "/_protected/"
 
 def load_settings() -> Settings:
     if not CONFIG_PATH.exists():
@@ -56,19 +85,83 @@ def load_settings() -> Settings:
 SETTINGS = load_settings()
 LIB_ROOT = Path(SETTINGS.library_root).resolve()
 
+def _compile_path_list(patterns: List[str]) -> Optional["re.Pattern[str]"]:
+    """One regex matching a relative path equal to or inside any of the patterns."""
+    norm = [p for p in (pat.strip("/").lower() for pat in patterns or []) if p]
+    if not norm:
+        return None
+    return re.compile("^(?:" + "|".join(re.escape(p) for p in norm) + ")(?:/|$)")
+
+# Built once here; these are checked for every directory during a scan
+_HIDDEN_LOWER = frozenset(n.lower() for n in SETTINGS.hidden_dir_names)
+_ADULT_RE = _compile_path_list(SETTINGS.adult_paths)
+_KIDS_RE = _compile_path_list(SETTINGS.kids_paths)
+
 # ------------------------------------------------------------
 # Database
 # ------------------------------------------------------------
 
 DB_LOCK = threading.RLock()
 
+# Per-connection tuning. journal_mode=WAL is persistent in the db file and is
+# set once in init_db(); these have to be applied on every connection.
+DB_PRAGMAS = (
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-65536",      # 64 MiB
+    "PRAGMA mmap_size=268435456",    # 256 MiB
+    "PRAGMA busy_timeout=60000",
+)
+
 def db():
-    conn = sqlite3.connect(DB_PATH)
+    conn = sqlite3.connect(DB_PATH, check_same_thread=False)
     conn.row_factory = sqlite3.Row
+    for pragma in DB_PRAGMAS:
+        conn.execute(pragma)
     return conn
 
+# Connections are kept for the process lifetime: one writer serialized by
+# DB_LOCK, and a small pool of readers that (thanks to WAL) need no lock.
+READ_POOL_SIZE = 8
+_READ_POOL: "queue.Queue[sqlite3.Connection]" = queue.Queue(maxsize=READ_POOL_SIZE)
+_WRITE_CONN: Optional[sqlite3.Connection] = None
+
+@contextmanager
+def read_conn():
+    """Borrow a pooled connection for read-only queries."""
+    try:
+        conn = _READ_POOL.get_nowait()
+    except queue.Empty:
+        conn = db()
+    try:
+        yield conn
+    finally:
+        try:
+            _READ_POOL.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+@contextmanager
+def write_conn():
+    """Hold DB_LOCK and yield the shared writer; commits on success, rolls back on error."""
+    global _WRITE_CONN
+    with DB_LOCK:
+        if _WRITE_CONN is None:
+            _WRITE_CONN = db()
+        with _WRITE_CONN:
+            yield _WRITE_CONN
+
+# Indexes backing the api_browse listings; the trailing NOCASE name column
+# also satisfies their ORDER BY. Dropped and rebuilt around a full rescan.
+BROWSE_INDEXES = {
+    "idx_folders_parent": "CREATE INDEX IF NOT EXISTS idx_folders_parent ON folders(parent_id, name COLLATE NOCASE)",
+    "idx_media_folder": "CREATE INDEX IF NOT EXISTS idx_media_folder ON media(folder_id, name COLLATE NOCASE)",
+}
+
 def init_db():
-    with DB_LOCK, db() as conn:
+    with write_conn() as conn:
+        # WAL lets browse/stream readers run while a rescan is writing
+        conn.execute("PRAGMA journal_mode=WAL")
         c = conn.cursor()
         c.execute("""
             CREATE TABLE IF NOT EXISTS folders (
@@ -88,71 +181,75 @@ def init_db():
                 folder_id INTEGER NOT NULL
             )
         """)
+        for sql in BROWSE_INDEXES.values():
+            c.execute(sql)
         conn.commit()
 
-def is_video(p: Path) -> bool:
-    return p.suffix.lower() in VIDEO_EXTS
+def is_video(name: str) -> bool:
+    return os.path.splitext(name)[1].lower() in VIDEO_EXTS
 
-def find_subtitle(p: Path) -> Optional[Path]:
-    stem = p.with_suffix("")
+def mime_type(name: str, default: str) -> str:
+    return MIME_TYPES.get(os.path.splitext(name)[1].lower(), default)
+
+@functools.lru_cache(maxsize=65536)
+def find_subtitle(path: str) -> Optional[Path]:
+    """Sidecar subtitle for a media file; cached until the next scan (see clear_caches)."""
+    stem = Path(path).with_suffix("")
     for ext in SUB_EXTS:
         cand = stem.with_suffix(ext)
         if cand.exists():
             return cand
     return None
 
-def upsert_folder(conn: sqlite3.Connection, p: Path, parent_id: Optional[int]) -> int:
-    p = p.resolve()
+# Upserts keyed on the UNIQUE path column. Parent/folder ids are resolved by
+# path inside SQLite, so scan_library can batch rows with executemany as long
+# as parents are written before their children.
+UPSERT_FOLDER_SQL = """
+    INSERT INTO folders(path, name, parent_id, is_kids, poster)
+    VALUES (?, ?, (SELECT id FROM folders WHERE path=?), ?, ?)
+    ON CONFLICT(path) DO UPDATE SET
+        name=excluded.name,
+        parent_id=excluded.parent_id,
+        is_kids=excluded.is_kids,
+        poster=excluded.poster
+"""
+
+UPSERT_MEDIA_SQL = """
+    INSERT INTO media(path, name, folder_id)
+    VALUES (?, ?, (SELECT id FROM folders WHERE path=?))
+    ON CONFLICT(path) DO UPDATE SET
+        name=excluded.name,
+        folder_id=excluded.folder_id
+"""
+
+SCAN_BATCH_SIZE = 1000
+
+def folder_values(p: Path, parent: Optional[Path], names: Optional[Set[str]] = None) -> Tuple:
+    """Row for UPSERT_FOLDER_SQL: (path, name, parent path, is_kids, poster)."""
     name = p.name if p != LIB_ROOT else p.name or "/"
-    cur = conn.cursor()
-    cur.execute("SELECT id FROM folders WHERE path=?", (str(p),))
-    row = cur.fetchone()
-    if row:
-        fid = int(row["id"])
-        # keep name synced
-        cur.execute("UPDATE folders SET name=?, parent_id=? WHERE id=?", (name, parent_id, fid))
-        conn.commit()
-        return fid
-    cur.execute(
-        "INSERT INTO folders(path, name, parent_id, is_kids) VALUES (?, ?, ?, ?)",
-        (str(p), name, parent_id, 1 if SETTINGS.default_is_kids else 0)
+    return (
+        str(p),
+        name,
+        str(parent) if parent is not None else None,
+        1 if _is_kids_path(p) else 0,
+        find_poster(p, names),
     )
-    fid = cur.lastrowid
-    conn.commit()
-    return fid
-
-def upsert_media(conn: sqlite3.Connection, p: Path, folder_id: int) -> int:
-    p = p.resolve()
-    name = p.name
-    cur = conn.cursor()
-    cur.execute("SELECT id FROM media WHERE path=?", (str(p),))
-    row = cur.fetchone()
-    if row:
-        mid = int(row["id"])
-        cur.execute("UPDATE media SET name=?, folder_id=? WHERE id=?", (name, folder_id, mid))
-        conn.commit()
-        return mid
-    cur.execute("INSERT INTO media(path, name, folder_id) VALUES (?, ?, ?)", (str(p), name, folder_id))
-    mid = cur.lastrowid
-    conn.commit()
-    return mid
 
 def _is_hidden_name(name: str) -> bool:
-    return name.lower() in {n.lower() for n in SETTINGS.hidden_dir_names}
+    return name.lower() in _HIDDEN_LOWER
 
-def _in_path_list(path: Path, patterns: List[str]) -> bool:
-    """Return True if path is equal to or inside any of the listed relative patterns."""
+def _in_path_list(path: Path, pattern: Optional["re.Pattern[str]"]) -> bool:
+    """
+    Return True if path is equal to or inside any of the compiled relative patterns.
+    `path` must already be resolved, like LIB_ROOT and the paths scan_library walks.
+    """
+    if pattern is None:
+        return False
     try:
-        rel = path.resolve().relative_to(LIB_ROOT.resolve()).as_posix().lower()
-    except Exception:
+        rel = path.relative_to(LIB_ROOT).as_posix().lower()
+    except ValueError:
         return False
-    for pat in patterns or []:
-        p = pat.strip("/").lower()
-        if not p:
-            continue
-        if rel == p or rel.startswith(p + "/"):
-            return True
-    return False
+    return pattern.match(rel) is not None
 
 def _is_kids_path(path: Path) -> bool:
     """
@@ -164,17 +261,21 @@ def _is_kids_path(path: Path) -> bool:
       3) Else: fallback to default_is_kids
     """
     if len(SETTINGS.adult_paths) > 0:
-        return not _in_path_list(path, SETTINGS.adult_paths)
+        return not _in_path_list(path, _ADULT_RE)
     if len(SETTINGS.kids_paths) > 0:
-        return _in_path_list(path, SETTINGS.kids_paths)
+        return _in_path_list(path, _KIDS_RE)
     return SETTINGS.default_is_kids
 
-def find_poster(d: Path) -> Optional[str]:
-    """Optional folder poster lookup (not required by Roku app)."""
-    for name in ("poster.jpg", "poster.png", "folder.jpg", "folder.png"):
-        cand = d / name
-        if cand.exists():
-            return str(cand)
+POSTER_NAMES = ("poster.jpg", "poster.png", "folder.jpg", "folder.png")
+
+def find_poster(d: Path, names: Optional[Set[str]] = None) -> Optional[str]:
+    """
+    Optional folder poster lookup (not required by Roku app).
+    `names` are the poster names the caller already saw in `d`; without it the disk is checked.
+    """
+    for name in POSTER_NAMES:
+        if (name in names) if names is not None else (d / name).exists():
+            return str(d / name)
     return None
 
 def scan_library(full_rescan: bool = False) -> int:
@@ -182,54 +283,73 @@ def scan_library(full_rescan: bool = False) -> int:
         raise SystemExit(f"Library root does not exist: {LIB_ROOT}")
 
     count = 0
-    with DB_LOCK, db() as conn:
+    folder_rows: List[Tuple] = []
+    media_rows: List[Tuple] = []
+
+    # The whole scan is a single transaction, committed by write_conn()
+    with write_conn() as conn:
         c = conn.cursor()
+
+        def flush():
+            # folders first: media rows look up their folder id by path
+            if folder_rows:
+                c.executemany(UPSERT_FOLDER_SQL, folder_rows)
+                folder_rows.clear()
+            if media_rows:
+                c.executemany(UPSERT_MEDIA_SQL, media_rows)
+                media_rows.clear()
+
         if full_rescan:
             c.execute("DELETE FROM media")
             c.execute("DELETE FROM folders")
-            conn.commit()
-
-        root_id = upsert_folder(conn, LIB_ROOT, None)
-        c.execute("UPDATE folders SET is_kids=? WHERE id=?", (1 if _is_kids_path(LIB_ROOT) else 0, root_id))
-
-        path_to_id: Dict[Path, int] = {LIB_ROOT: root_id}
-
-        for dirpath, dirnames, filenames in os.walk(LIB_ROOT):
-            # hide any directory names listed (e.g., "images")
-            dirnames[:] = [dn for dn in dirnames if not _is_hidden_name(dn)]
-
-            d = Path(dirpath).resolve()
-
-            # ensure parent folder row exists
-            if d not in path_to_id:
-                parent = d.parent
-                parent_id = path_to_id.get(parent)
-                if parent_id is None:
-                    parent_id = upsert_folder(conn, parent, None)
-                    path_to_id[parent] = parent_id
-                fid = upsert_folder(conn, d, parent_id)
-                path_to_id[d] = fid
-            else:
-                fid = path_to_id[d]
-
-            # set classification based on config
-            c.execute("UPDATE folders SET is_kids=? WHERE id=?", (1 if _is_kids_path(d) else 0, fid))
-
-            # optional folder poster
-            c.execute("UPDATE folders SET poster=? WHERE id=?", (find_poster(d), fid))
-
-            # media rows
-            for fn in filenames:
-                p = d / fn
-                if is_video(p):
-                    upsert_media(conn, p, fid)
-                    count += 1
-
-        conn.commit()
+            # cheaper to build the indexes once after the bulk load
+            for name in BROWSE_INDEXES:
+                c.execute(f"DROP INDEX IF EXISTS {name}")
+
+        # Depth-first walk with os.scandir so file/dir checks use the cached
+        # d_type instead of a stat per entry. Like os.walk, directory symlinks
+        # are not followed; LIB_ROOT is already resolved, so paths stay canonical.
+        stack: List[Tuple[Path, Optional[Path]]] = [(LIB_ROOT, None)]
+        while stack:
+            d, parent = stack.pop()
+            posters: Set[str] = set()
+
+            try:
+                it = os.scandir(d)
+            except OSError:
+                it = None
+            if it is not None:
+                with it:
+                    for e in it:
+                        if e.is_dir(follow_symlinks=False):
+                            # hide any directory names listed (e.g., "images")
+                            if not _is_hidden_name(e.name):
+                                stack.append((d / e.name, d))
+                        elif e.name in POSTER_NAMES:
+                            posters.add(e.name)
+                        elif is_video(e.name) and e.is_file():
+                            # symlinked files are stored by their target, as before
+                            path = os.path.realpath(e.path) if e.is_symlink() else e.path
+                            media_rows.append((path, os.path.basename(path), str(d)))
+                            count += 1
+
+            # still ahead of anything below d: its subfolders are only on the stack
+            folder_rows.append(folder_values(d, parent, posters))
+
+            if len(folder_rows) + len(media_rows) >= SCAN_BATCH_SIZE:
+                flush()
+
+        flush()
+
+        for sql in BROWSE_INDEXES.values():
+            c.execute(sql)
+        c.execute("ANALYZE folders")
+        c.execute("ANALYZE media")
+    clear_caches()
     return count
 
 # ------------------------------------------------------------
-# Auth token (simple HMAC)
+# Auth token (keyed BLAKE2b)
 # ------------------------------------------------------------
 
 def _b64url(b: bytes) -> str:
@@ -239,22 +359,45 @@ def _unb64url(s: str) -> bytes:
     pad = "=" * ((4 - len(s) % 4) % 4)
     return base64.urlsafe_b64decode(s + pad)
 
+# Bumped whenever the token format or signature changes; older tokens are rejected
+_TOKEN_VERSION = 2
+
+_SECRET_BYTES = SETTINGS.secret_key.encode("utf-8")
+# keyed BLAKE2b takes at most 64 key bytes; longer secrets are hashed down
+_TOKEN_KEY = _SECRET_BYTES if len(_SECRET_BYTES) <= 64 else hashlib.blake2b(_SECRET_BYTES).digest()
+# Keyed once at import; _sign() copies it instead of redoing the key setup
+_TOKEN_HASH = hashlib.blake2b(key=_TOKEN_KEY, digest_size=16)
+_SIG_B64_LEN = len(_b64url(bytes(_TOKEN_HASH.digest_size)))
+_MAX_TOKEN_LEN = 128
+
+def _sign(payload: bytes) -> bytes:
+    h = _TOKEN_HASH.copy()
+    h.update(payload)
+    return h.digest()
+
 def make_folder_token(folder_id: int, hours: int) -> str:
     exp = int(time.time()) + int(hours) * 3600
-    payload = f"{folder_id}.{exp}".encode("utf-8")
-    sig = hmac.new(SETTINGS.secret_key.encode("utf-8"), payload, hashlib.sha256).digest()
+    payload = f"{_TOKEN_VERSION}.{folder_id}.{exp}".encode("utf-8")
+    sig = _sign(payload)
     return _b64url(payload) + "." + _b64url(sig)
 
 def verify_folder_token(token: str, folder_id: int) -> bool:
+    # cheap shape checks first so junk tokens don't go through base64/exceptions
+    if len(token) > _MAX_TOKEN_LEN:
+        return False
+    payload_b64, sep, sig_b64 = token.partition(".")
+    if not sep or not payload_b64 or len(sig_b64) != _SIG_B64_LEN:
+        return False
     try:
-        payload_b64, sig_b64 = token.split(".", 1)
         payload = _unb64url(payload_b64)
         sig = _unb64url(sig_b64)
-        expect_sig = hmac.new(SETTINGS.secret_key.encode("utf-8"), payload, hashlib.sha256).digest()
+        expect_sig = _sign(payload)
         if not hmac.compare_digest(sig, expect_sig):
             return False
         s = payload.decode("utf-8")
-        fid_s, exp_s = s.split(".", 1)
+        ver_s, fid_s, exp_s = s.split(".")
+        if int(ver_s) != _TOKEN_VERSION:
+            return False
         if int(fid_s) != int(folder_id):
             return False
         if int(exp_s) < int(time.time()):
@@ -264,15 +407,12 @@ def verify_folder_token(token: str, folder_id: int) -> bool:
         return False
 
 def folder_requires_auth(folder_id: int) -> bool:
-    with DB_LOCK, db() as conn:
-        c = conn.cursor()
-        c.execute("SELECT is_kids FROM folders WHERE id=?", (folder_id,))
-        row = c.fetchone()
-        if row is None:
-            return False
-        is_kids = int(row["is_kids"])
-        # Require auth for NON-kids folders
-        return is_kids == 0
+    row = folder_row(folder_id)
+    if row is None:
+        return False
+    is_kids = int(row["is_kids"])
+    # Require auth for NON-kids folders
+    return is_kids == 0
 
 # ------------------------------------------------------------
 # Tolerant token extraction & request auth
@@ -307,7 +447,7 @@ def check_request_authorized(request: Request, folder_id: int) -> bool:
 # FastAPI app
 # ------------------------------------------------------------
 
-app = FastAPI(title="Local Media Server")
+app = FastAPI(title="Local Media Server", default_response_class=ORJSONResponse)
 
 app.add_middleware(
     CORSMiddleware,
@@ -328,19 +468,201 @@ class AuthFolderReq(BaseModel):
 class RescanReq(BaseModel):
     full: bool = False
 
+# ------------------------------------------------------------
+# File responses
+# ------------------------------------------------------------
+
+ZEROCOPY_EXT = "http.response.zerocopysend"
+
+def _single_byte_range(value: str, size: int) -> Optional[Tuple[int, int]]:
+    """
+    Parse a Range header holding one byte range into inclusive (start, end).
+    Returns None for anything else (multi-range, malformed, unsatisfiable).
+    """
+    unit, _, spec = value.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    start_s, sep, end_s = spec.strip().partition("-")
+    if not sep:
+        return None
+    try:
+        if start_s:
+            start = int(start_s)
+            end = int(end_s) if end_s else size - 1
+        else:
+            # suffix range: the last N bytes
+            start = max(size - int(end_s), 0)
+            end = size - 1
+    except ValueError:
+        return None
+    end = min(end, size - 1)
+    if start < 0 or start > end:
+        return None
+    return start, end
+
+class ZeroCopyFileResponse(FileResponse):
+    """
+    FileResponse that hands the open file to the ASGI server when it offers the
+    zero-copy send extension, so the kernel moves the bytes (sendfile) rather
+    than a Python read()/send() loop. Requests the fast path can't serve as-is
+    (no extension, If-Range, multi-range or bad ranges) go to FileResponse.
+    """
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        headers = Headers(scope=scope)
+        if ZEROCOPY_EXT not in scope.get("extensions", {}) or "if-range" in headers:
+            return await super().__call__(scope, receive, send)
+
+        if self.stat_result is None:
+            self.stat_result = await anyio.to_thread.run_sync(os.stat, self.path)
+            self.set_stat_headers(self.stat_result)
+        size = self.stat_result.st_size
+
+        status, start, end = self.status_code, 0, size - 1
+        http_range = headers.get("range")
+        if http_range is not None:
+            rng = _single_byte_range(http_range, size)
+            if rng is None:
+                return await super().__call__(scope, receive, send)
+            start, end = rng
+            status = 206
+            self.headers["content-range"] = f"bytes {start}-{end}/{size}"
+            self.headers["content-length"] = str(end - start + 1)
+
+        await send({"type": "http.response.start", "status": status, "headers": self.raw_headers})
+        if scope["method"].upper() == "HEAD" or size == 0:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+        else:
+            f = await anyio.to_thread.run_sync(open, self.path, "rb")
+            try:
+                await send({
+                    "type": ZEROCOPY_EXT,
+                    "file": f,
+                    "offset": start,
+                    "count": end - start + 1,
+                    "more_body": False,
+                })
+            finally:
+                f.close()
+
+        if self.background is not None:
+            await self.background()
+
+CACHE_MAX_AGE = 86400
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    # weak comparison, as required for If-None-Match
+    if if_none_match.strip() == "*":
+        return True
+    bare = etag.removeprefix("W/")
+    return any(t.strip().removeprefix("W/") == bare for t in if_none_match.split(","))
+
+def cached_file_response(request: Request, path: Path, st: os.stat_result, media_type: str,
+                         private: bool = False) -> Response:
+    """
+    FileResponse with ETag/Last-Modified/Cache-Control for files that only change
+    between rescans (artwork, subtitles). A matching conditional request gets an
+    empty 304 instead of the body.
+    """
+    etag = f'W/"{st.st_mtime_ns:x}-{st.st_size:x}"'
+    headers = {
+        "ETag": etag,
+        "Last-Modified": formatdate(st.st_mtime, usegmt=True),
+        "Cache-Control": f"{'private' if private else 'public'}, max-age={CACHE_MAX_AGE}",
+    }
+    inm = request.headers.get("if-none-match")
+    ims = request.headers.get("if-modified-since")
+    if inm is not None:
+        not_modified = _etag_matches(inm, etag)
+    elif ims is not None:
+        try:
+            not_modified = int(st.st_mtime) <= parsedate_to_datetime(ims).timestamp()
+        except (TypeError, ValueError):
+            not_modified = False
+    else:
+        not_modified = False
+    if not_modified:
+        return Response(status_code=304, headers=headers)
+    return FileResponse(str(path), media_type=media_type, headers=headers, stat_result=st)
+
 # ------------------------------------------------------------
 # Browse / Stream / Subtitle
 # ------------------------------------------------------------
 
-def folder_row(conn: sqlite3.Connection, folder_id: int) -> Optional[sqlite3.Row]:
-    cur = conn.cursor()
-    cur.execute("SELECT id, path, name, parent_id, is_kids FROM folders WHERE id=?", (folder_id,))
-    return cur.fetchone()
+# clear_caches() bumps the generation. Lazy loaders note it before querying
+# and only store their result if it hasn't moved, so a snapshot read before a
+# rescan committed can't be stored after that rescan invalidated the caches.
+_CACHE_LOCK = threading.Lock()
+_CACHE_GEN = 0
+
+# folder id -> row; misses aren't cached so unknown ids can't grow it
+_FOLDER_ROWS: Dict[int, sqlite3.Row] = {}
+
+def folder_row(folder_id: int) -> Optional[sqlite3.Row]:
+    """Cached folder lookup; folders only change on rescan (see clear_caches)."""
+    row = _FOLDER_ROWS.get(folder_id)
+    if row is not None:
+        return row
+    gen = _CACHE_GEN
+    with read_conn() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT id, path, name, parent_id, is_kids FROM folders WHERE id=?", (folder_id,))
+        # run to completion so the pooled connection holds no read snapshot
+        rows = cur.fetchall()
+    if not rows:
+        return None
+    row = rows[0]
+    with _CACHE_LOCK:
+        if gen == _CACHE_GEN:
+            _FOLDER_ROWS[folder_id] = row
+    return row
+
+# media id -> (path, folder_id), loaded in one query on first use
+_MEDIA_INDEX: Optional[Dict[int, Tuple[str, int]]] = None
+
+def media_entry(media_id: int) -> Optional[Tuple[str, int]]:
+    """Look up (path, folder_id) for a media id without touching the db per request."""
+    global _MEDIA_INDEX
+    index = _MEDIA_INDEX
+    if index is None:
+        gen = _CACHE_GEN
+        with read_conn() as conn:
+            cur = conn.cursor()
+            cur.row_factory = None
+            cur.execute("SELECT id, path, folder_id FROM media")
+            index = {mid: (path, int(fid)) for mid, path, fid in cur}
+        with _CACHE_LOCK:
+            if gen == _CACHE_GEN:
+                _MEDIA_INDEX = index
+    entry = index.get(media_id)
+    if entry is None:
+        # not in the snapshot; ask the db directly
+        with read_conn() as conn:
+            cur = conn.cursor()
+            cur.execute("SELECT path, folder_id FROM media WHERE id=?", (media_id,))
+            # fetchall runs the statement to completion, so the pooled
+            # connection isn't handed back holding an open read snapshot
+            rows = cur.fetchall()
+        if rows:
+            entry = (rows[0]["path"], int(rows[0]["folder_id"]))
+    return entry
+
+def clear_caches():
+    """Drop in-memory lookups derived from the library; called after every scan."""
+    global _ART_INDEX, _MEDIA_INDEX, _CACHE_GEN
+    with _CACHE_LOCK:
+        _CACHE_GEN += 1
+        _FOLDER_ROWS.clear()
+        find_subtitle.cache_clear()
+        _ART_INDEX = None
+        _MEDIA_INDEX = None
 
 @app.get("/api/browse")
 def api_browse(dir_id: Optional[int] = None, request: Request = None):
-    with DB_LOCK, db() as conn:
+    with read_conn() as conn:
         c = conn.cursor()
+        # plain tuples: rows are unpacked straight into the response below
+        c.row_factory = None
 
         # determine root id if none provided
         if dir_id is None:
@@ -348,93 +670,130 @@ def api_browse(dir_id: Optional[int] = None, request: Request = None):
             row = c.fetchone()
             if not row:
                 raise HTTPException(404, "Library not initialized")
-            dir_id = int(row["id"])
+            dir_id = int(row[0])
 
         # auth gate for non-kids folders
         if folder_requires_auth(dir_id):
             if not check_request_authorized(request, dir_id):
-                return {"authorized": False}
+                return ORJSONResponse({"authorized": False})
 
-        row = folder_row(conn, dir_id)
+        row = folder_row(dir_id)
         if not row:
             raise HTTPException(404, "Folder not found")
 
         # subdirs
         c.execute("SELECT id, name FROM folders WHERE parent_id=? ORDER BY name COLLATE NOCASE ASC", (dir_id,))
-        subdirs = [{"id": int(r["id"]), "name": r["name"]} for r in c.fetchall()]
+        subdirs = [{"id": i, "name": n} for i, n in c.fetchall()]
 
         # media
         c.execute("SELECT id, name FROM media WHERE folder_id=? ORDER BY name COLLATE NOCASE ASC", (dir_id,))
-        media = [{"id": int(r["id"]), "name": r["name"]} for r in c.fetchall()]
+        media = [{"id": i, "name": n} for i, n in c.fetchall()]
 
-        return {
+        # returned as a response so FastAPI skips jsonable_encoder on large listings
+        return ORJSONResponse({
             "authorized": True,
             "dir": {"id": int(row["id"]), "name": row["name"], "is_kids": bool(row["is_kids"])},
             "subdirs": subdirs,
             "media": media,
-        }
+        })
 
 @app.get("/api/stream")
 def api_stream(media_id: int, request: Request = None):
-    with DB_LOCK, db() as conn:
-        c = conn.cursor()
-        c.execute("SELECT m.path, m.folder_id FROM media m WHERE m.id=?", (media_id,))
-        r = c.fetchone()
-        if not r:
-            raise HTTPException(404, "Media not found")
-        folder_id = int(r["folder_id"])
-        if folder_requires_auth(folder_id) and not check_request_authorized(request, folder_id):
-            raise HTTPException(401, "Unauthorized")
-        p = Path(r["path"])
-        if not p.exists():
-            raise HTTPException(404, "File missing on disk")
-        mt, _ = mimetypes.guess_type(p.name)
-        return FileResponse(str(p), media_type=mt or "video/mp4")
+    entry = media_entry(media_id)
+    if entry is None:
+        raise HTTPException(404, "Media not found")
+    path, folder_id = entry
+    if folder_requires_auth(folder_id) and not check_request_authorized(request, folder_id):
+        raise HTTPException(401, "Unauthorized")
+    p = Path(path)
+    if SETTINGS.use_x_accel_redirect:
+        # nginx serves the file from its internal location mapped onto library_root
+        try:
+            rel = p.relative_to(LIB_ROOT).as_posix()
+        except ValueError:
+            rel = None  # symlink target outside the library; serve it ourselves
+        if rel is not None:
+            return Response(
+                headers={"X-Accel-Redirect": SETTINGS.x_accel_prefix.rstrip("/") + "/" + quote(rel)},
+                media_type=mime_type(p.name, "video/mp4"),
+            )
+    try:
+        st = p.stat()
+    except FileNotFoundError:
+        raise HTTPException(404, "File missing on disk")
+    return ZeroCopyFileResponse(str(p), media_type=mime_type(p.name, "video/mp4"), stat_result=st)
 
 @app.get("/api/subtitle")
 def api_subtitle(media_id: int, request: Request = None):
-    with DB_LOCK, db() as conn:
-        c = conn.cursor()
-        c.execute("SELECT m.path, m.folder_id FROM media m WHERE m.id=?", (media_id,))
-        r = c.fetchone()
-        if not r:
-            raise HTTPException(404, "Media not found")
-        folder_id = int(r["folder_id"])
-        if folder_requires_auth(folder_id) and not check_request_authorized(request, folder_id):
-            raise HTTPException(401, "Unauthorized")
-        p = Path(r["path"])
-        sub = find_subtitle(p)
-        if not sub:
-            raise HTTPException(404, "Subtitle not found")
-        mt, _ = mimetypes.guess_type(sub.name)
-        return FileResponse(str(sub), media_type=mt or "text/plain")
+    entry = media_entry(media_id)
+    if entry is None:
+        raise HTTPException(404, "Media not found")
+    path, folder_id = entry
+    if folder_requires_auth(folder_id) and not check_request_authorized(request, folder_id):
+        raise HTTPException(401, "Unauthorized")
+    sub = find_subtitle(path)
+    if not sub:
+        raise HTTPException(404, "Subtitle not found")
+    try:
+        st = sub.stat()
+    except FileNotFoundError:
+        raise HTTPException(404, "Subtitle not found")
+    # private: subtitles of restricted folders sit behind the folder token
+    return cached_file_response(request, sub, st, mime_type(sub.name, "text/plain"), private=True)
 
 # ------------------------------------------------------------
 # Artwork: /images/<name>.(png|jpg|jpeg|webp)
 # ------------------------------------------------------------
 
+# (lowercased file name -> path, lowercased stem -> path), built on first use
+_ART_INDEX: Optional[Tuple[Dict[str, Path], Dict[str, Path]]] = None
+
+def art_index() -> Tuple[Dict[str, Path], Dict[str, Path]]:
+    """Index LIB_ROOT/images once instead of probing the disk per request."""
+    global _ART_INDEX
+    index = _ART_INDEX
+    if index is None:
+        gen = _CACHE_GEN
+        by_name: Dict[str, Path] = {}
+        by_stem: Dict[str, Tuple[int, Path]] = {}
+        try:
+            with os.scandir(LIB_ROOT / "images") as it:
+                for e in it:
+                    if not e.is_file():
+                        continue
+                    by_name[e.name.lower()] = Path(e.path)
+                    stem, ext = os.path.splitext(e.name)
+                    ext = ext.lower()
+                    if ext in ART_EXTS:
+                        # same priority as ART_EXTS when a stem has several files
+                        rank = ART_EXTS.index(ext)
+                        key = stem.lower()
+                        if key not in by_stem or rank < by_stem[key][0]:
+                            by_stem[key] = (rank, Path(e.path))
+        except OSError:
+            pass
+        index = (by_name, {k: p for k, (_, p) in by_stem.items()})
+        with _CACHE_LOCK:
+            if gen == _CACHE_GEN:
+                _ART_INDEX = index
+    return index
+
 @app.get("/api/art")
-def api_art(name: str):
+def api_art(name: str, request: Request):
     base = os.path.basename(name).strip()
     if not base:
         raise HTTPException(400, "Missing name")
-    images_dir = LIB_ROOT / "images"
-    candidates: List[Path] = []
-
-    # if client passed extension, try exact
-    cand_exact = images_dir / base
-    candidates.append(cand_exact)
+    by_name, by_stem = art_index()
 
-    # stem + known art extensions
-    stem = Path(base).stem
-    for ext in ART_EXTS:
-        candidates.append(images_dir / f"{stem}{ext}")
-
-    for cand in candidates:
-        if cand.exists() and cand.is_file():
-            mt, _ = mimetypes.guess_type(cand.name)
-            return FileResponse(str(cand), media_type=mt or "image/png")
-    raise HTTPException(404, "Artwork not found")
+    # if client passed extension, try exact; then stem + known art extensions
+    cand = by_name.get(base.lower()) or by_stem.get(Path(base).stem.lower())
+    if cand is None:
+        raise HTTPException(404, "Artwork not found")
+    try:
+        st = cand.stat()
+    except FileNotFoundError:
+        raise HTTPException(404, "Artwork not found")
+    return cached_file_response(request, cand, st, mime_type(cand.name, "image/png"))
 
 # ------------------------------------------------------------
 # Auth: PIN -> bearer token for folder
@@ -475,13 +834,11 @@ def root_redirect():
 # ------------------------------------------------------------
 
 def ensure_root_row():
-    with DB_LOCK, db() as conn:
+    with write_conn() as conn:
         c = conn.cursor()
         c.execute("SELECT id FROM folders WHERE path=?", (str(LIB_ROOT),))
         if not c.fetchone():
-            root_id = upsert_folder(conn, LIB_ROOT, None)
-            c.execute("UPDATE folders SET is_kids=? WHERE id=?", (1 if _is_kids_path(LIB_ROOT) else 0, root_id))
-            conn.commit()
+            c.execute(UPSERT_FOLDER_SQL, folder_values(LIB_ROOT, None))
 
 def main():
     init_db()